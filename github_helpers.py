@@ -4,72 +4,144 @@ import os
 import keyring
 import base64
 import re
+import functools
 
+@functools.lru_cache(maxsize=4)
 def get_github_client(token: str = None):
     """
     Return a PyGithub Github client. Token resolution performed outside
     (prefer st.secrets, env var, keyring).
+    Clients are memoized per token so Streamlit reruns reuse the same connection pool.
     """
     if not token:
         raise ValueError("GitHub token required")
-    return Github(token)
+    return Github(token, per_page=100, retry=3, pool_size=16)
 
-def list_text_files_in_folder(repo, folder_path):
+def get_tree_blobs(repo, branch):
     """
-    Return list of ContentFile objects for files in a folder path.
+    Return (path, sha) for every blob on branch from a single recursive git tree call.
+    Raises ValueError if GitHub truncated the tree rather than return a partial listing.
     """
-    try:
-        contents = repo.get_contents(folder_path)
-    except Exception as e:
-        # folder missing -> empty list
-        return []
-    files = [c for c in contents if c.type == "file" and c.name.lower().endswith(".txt")]
-    return files
+    tree = repo.get_git_tree(branch, recursive=True)
+    if tree.raw_data.get("truncated"):
+        raise ValueError(f"Git tree for {branch} is too large and was truncated by GitHub")
+    return [(e.path, e.sha) for e in tree.tree if e.type == "blob"]
 
-def read_file_contents(repo, path):
+def list_tree_txt(blobs, prefix):
     """
-    Return decoded string contents for a file at path.
+    Filter get_tree_blobs output to .txt files directly inside folder prefix.
     """
-    contents = repo.get_contents(path)
-    raw = contents.decoded_content.decode("utf-8")
-    return raw, contents.sha
+    folder = prefix.rstrip("/") + "/"
+    return [
+        (path, sha) for path, sha in blobs
+        if path.startswith(folder) and "/" not in path[len(folder):]
+        and path.lower().endswith(".txt")
+    ]
+
+def fetch_files_bulk(repo, branch, paths, chunk_size=100):
+    """
+    Fetch many text files in as few requests as possible using the GraphQL API.
+    Each request aliases up to chunk_size `object(expression: "branch:path")` lookups.
+    Returns {path: (text, oid)}; missing, binary or truncated files are left out so a
+    partial text is never written back.
+    """
+    paths = list(paths)
+    owner, name = repo.full_name.split("/", 1)
+    out = {}
+    for start in range(0, len(paths), chunk_size):
+        chunk = paths[start:start + chunk_size]
+        var_defs = "".join(f", $e{i}: String!" for i in range(len(chunk)))
+        fields = "\n".join(
+            f"f{i}: object(expression: $e{i}) {{ ... on Blob {{ text oid isTruncated }} }}"
+            for i in range(len(chunk))
+        )
+        query = (
+            f"query($owner: String!, $name: String!{var_defs}) {{\n"
+            f"repository(owner: $owner, name: $name) {{\n{fields}\n}}\n}}"
+        )
+        variables = {"owner": owner, "name": name}
+        for i, path in enumerate(chunk):
+            variables[f"e{i}"] = f"{branch}:{path}"
+        _, data = repo.requester.requestJsonAndCheck(
+            "POST", "/graphql", input={"query": query, "variables": variables}
+        )
+        if data.get("errors"):
+            raise ValueError(f"GraphQL error: {data['errors'][0].get('message')}")
+        objects = (data.get("data") or {}).get("repository") or {}
+        for i, path in enumerate(chunk):
+            blob = objects.get(f"f{i}")
+            if blob and blob.get("text") is not None and not blob.get("isTruncated"):
+                out[path] = (blob["text"], blob["oid"])
+    return out
+
+@functools.lru_cache(maxsize=32)
+def _compile_tag_patterns(start_tag, end_tag):
+    """
+    Compile (and cache) case-insensitive literal patterns for start_tag and end_tag.
+    """
+    return (re.compile(re.escape(start_tag), re.IGNORECASE),
+            re.compile(re.escape(end_tag), re.IGNORECASE))
 
 def safe_replace_between_tags(original_text, start_tag, end_tag, new_inner_text):
     """
     Replace everything between start_tag and end_tag (inclusive of tags is not replaced,
     only inner content) with new_inner_text. Returns new text.
+    Tags are matched as literals, case-insensitively; only the first start tag and the
+    nearest end tag after it are replaced.
     If tags aren't present, raises ValueError.
     """
-    pattern = re.compile(
-        re.escape(start_tag) + r"(.*?)" + re.escape(end_tag),
-        flags=re.DOTALL | re.IGNORECASE
-    )
-    if not pattern.search(original_text):
-        raise ValueError(f"Tags not found: {start_tag} ... {end_tag}")
-    replacement = start_tag + "\n" + new_inner_text + "\n" + end_tag
-    new_text = pattern.sub(replacement, original_text)
-    return new_text
+    if original_text.isascii() and start_tag.isascii() and end_tag.isascii():
+        # lower() keeps offsets aligned for ASCII, so str.find on the lowercased
+        # haystack is a literal case-insensitive search
+        lowered = original_text.lower()
+        s = lowered.find(start_tag.lower())
+        e = lowered.find(end_tag.lower(), s + len(start_tag)) if s >= 0 else -1
+        if e < 0:
+            raise ValueError(f"Tags not found: {start_tag} ... {end_tag}")
+        e += len(end_tag)
+    else:
+        # lower() can change the length of non-ASCII text; search the original instead
+        start_pattern, end_pattern = _compile_tag_patterns(start_tag, end_tag)
+        start = start_pattern.search(original_text)
+        end = end_pattern.search(original_text, start.end()) if start else None
+        if not end:
+            raise ValueError(f"Tags not found: {start_tag} ... {end_tag}")
+        s, e = start.start(), end.end()
+    return original_text[:s] + start_tag + "\n" + new_inner_text + "\n" + end_tag + original_text[e:]
 
-def write_or_update_file(repo, path, new_text, commit_message, branch="main"):
-    """
-    Create or update file at path in repo. Uses repo.get_contents+update_file or create_file.
-    """
-    try:
-        contents = repo.get_contents(path, ref=branch)
-        repo.update_file(contents.path, commit_message, new_text, contents.sha, branch=branch)
-        return {"action": "updated", "path": path}
-    except Exception as e:
-        # create if not exists
-        try:
-            repo.create_file(path, commit_message, new_text, branch=branch)
-            return {"action": "created", "path": path}
-        except Exception as e2:
-            raise
+def commit_many(repo, branch, files, commit_message):
+    """
+    Write several files in a single commit using the Git data API.
+    files is a {path: new_text} mapping. Returns the action and new commit sha.
+    """
+    ref = repo.get_git_ref(f"heads/{branch}")
+    parent = repo.get_git_commit(ref.object.sha)
+    elements = [
+        InputGitTreeElement(path=p, mode="100644", type="blob", content=t)
+        for p, t in files.items()
+    ]
+    tree = repo.create_git_tree(elements, base_tree=parent.tree)
+    commit = repo.create_git_commit(commit_message, tree, [parent])
+    ref.edit(commit.sha)
+    return {"action": "committed", "sha": commit.sha}
 
-def get_json_from_repo(repo, path):
+# (repo url, path, params) -> (etag, body); module level so every Streamlit session shares it.
+# Not keyed on the token: the app only reaches this after a non-lazy g.get_repo has
+# confirmed the caller's token can read the repo.
+_etag_cache = {}
+
+def get_json_with_etag(repo, path, parameters=None):
     """
-    Read a JSON file from repo and return parsed JSON (calls read_file_contents).
+    GET a REST resource under the repo url, replaying the last ETag seen for it.
+    On 304 Not Modified the previously stored body is returned.
     """
-    import json
-    text, sha = read_file_contents(repo, path)
-    return json.loads(text), sha
+    key = (repo.url, path, tuple(sorted((parameters or {}).items())))
+    etag, body = _etag_cache.get(key, (None, None))
+    headers = {"If-None-Match": etag} if etag else None
+    resp_headers, data = repo.requester.requestJsonAndCheck(
+        "GET", f"{repo.url}{path}", parameters=parameters, headers=headers
+    )
+    if data is None:
+        return body
+    _etag_cache[key] = (resp_headers.get("etag"), data)
+    return data
@@ -2,8 +2,9 @@
 import streamlit as st
 import os
 import json
+import base64
 import keyring
-from github_helpers import get_github_client, list_text_files_in_folder, read_file_contents, safe_replace_between_tags, write_or_update_file, get_json_from_repo
+from github_helpers import get_github_client, get_tree_blobs, list_tree_txt, fetch_files_bulk, safe_replace_between_tags, commit_many, get_json_with_etag
 
 st.set_page_config(page_title="Letterbox: Template Updater", layout="wide")
 
@@ -12,21 +13,25 @@ st.title("Letterbox — wording & signature updates (private repo)")
 # ---------------------------
 # Token resolution
 # ---------------------------
+def _safe_keyring():
+    # OS keyring (local dev)
+    try:
+        return keyring.get_password("github", "github_token")
+    except Exception:
+        return None
+
 def resolve_token():
+    # cached per session: the keyring lookup is an IPC call and the script reruns on every interaction
+    if st.session_state.get("token"):
+        return st.session_state["token"]
     # 1) Streamlit secrets (when deployed on Streamlit Cloud)
-    if st.secrets.get("GITHUB_TOKEN"):
-        return st.secrets["GITHUB_TOKEN"]
     # 2) Environment variable
-    if os.environ.get("GITHUB_TOKEN"):
-        return os.environ.get("GITHUB_TOKEN")
     # 3) OS keyring (local dev)
-    try:
-        tk = keyring.get_password("github", "github_token")
-        if tk:
-            return tk
-    except Exception:
-        pass
-    return None
+    tk = (st.secrets.get("GITHUB_TOKEN") or os.environ.get("GITHUB_TOKEN")
+          or _safe_keyring())
+    if tk:
+        st.session_state["token"] = tk
+    return tk
 
 token = resolve_token()
 if not token:
@@ -35,6 +40,28 @@ if not token:
 
 g = get_github_client(token)
 
+# ---------------------------
+# Cached repo reads (Streamlit reruns the script on every widget change)
+# These caches are shared by all sessions and not keyed on the token. Isolation between
+# tokens relies on the non-lazy g.get_repo(repo_fullname) access check below running
+# before any cached read; keep that call non-lazy.
+# ---------------------------
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_tree(repo_fullname, branch):
+    # one recursive tree call per repo/branch; errors raise and are not cached
+    repo = g.get_repo(repo_fullname, lazy=True)
+    return get_tree_blobs(repo, branch)
+
+def list_txt(repo_fullname, branch, folder):
+    return [{"name": path.rsplit("/", 1)[-1], "path": path, "sha": sha}
+            for path, sha in list_tree_txt(cached_tree(repo_fullname, branch), folder)]
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_get_json(repo_fullname, path):
+    repo = g.get_repo(repo_fullname, lazy=True)
+    data = get_json_with_etag(repo, f"/contents/{path}")
+    return json.loads(base64.b64decode(data["content"]).decode("utf-8")), data["sha"]
+
 # ---------------------------
 # Private repo configuration
 # ---------------------------
@@ -50,6 +77,7 @@ if not repo_owner or not repo_name:
 
 repo_fullname = f"{repo_owner}/{repo_name}"
 try:
+    # non-lazy on purpose: this is the access check the shared caches above rely on
     repo = g.get_repo(repo_fullname)
 except Exception as e:
     st.error(f"Unable to open repo {repo_fullname}: {e}")
@@ -62,9 +90,13 @@ operation = st.radio("Choose update type:", ("Wording updates", "Signature updat
 
 # Common helper: preview list of base_templates files
 st.sidebar.markdown("### Repo folders (read-only preview)")
+try:
+    base_files = list_txt(repo_fullname, branch, "base_templates")
+    updated_files = list_txt(repo_fullname, branch, "updated_letters")
+except Exception as e:
+    st.error(f"Could not list files on branch {branch}: {e}")
+    st.stop()
 with st.sidebar.expander("Preview `base_templates` and `updated_letters` file counts"):
-    base_files = list_text_files_in_folder(repo, "base_templates")
-    updated_files = list_text_files_in_folder(repo, "updated_letters")
     st.write(f"Found {len(base_files)} files in `base_templates`")
     st.write(f"Found {len(updated_files)} files in `updated_letters`")
 
@@ -86,21 +118,43 @@ if operation == "Wording updates":
             total = max(1, len(base_files))
             i = 0
             results = []
+            pending = {}
+            # prefetch the current updated_letters copies too, to skip files that would not change
+            try:
+                contents = fetch_files_bulk(repo, branch, [f["path"] for f in base_files]
+                                            + [f"updated_letters/{f['name']}" for f in base_files])
+            except Exception as e:
+                st.error(f"Could not read templates from repo: {e}")
+                st.stop()
+            step = max(1, total // 20)  # redraw the bar roughly every 5%
             for f in base_files:
                 i += 1
-                progress.progress(int(i/total*100))
+                if i % step == 0 or i == total:
+                    progress.progress(int(i/total*100))
                 try:
-                    original_text, sha = read_file_contents(repo, f.path)
+                    if f["path"] not in contents:
+                        raise ValueError(f"Could not read {f['path']}")
+                    original_text, sha = contents[f["path"]]
                     new_text = safe_replace_between_tags(original_text,
                                                          "<!-- start here -->",
                                                          "<!-- end here -->",
                                                          paste_block)
-                    target_path = f"updated_letters/{f.name}"
-                    commit_message = f"Wording update: injected block into {f.name}"
-                    res = write_or_update_file(repo, target_path, new_text, commit_message, branch=branch)
-                    results.append((f.name, "ok", res))
+                    target_path = f"updated_letters/{f['name']}"
+                    if target_path in contents and contents[target_path][0] == new_text:
+                        results.append((f["name"], "skipped", "no change"))
+                        continue
+                    pending[target_path] = new_text
+                    results.append((f["name"], "ok", target_path))
                 except Exception as e:
-                    results.append((f.name, "error", str(e)))
+                    results.append((f["name"], "error", str(e)))
+            if pending:
+                commit_message = f"Wording update: injected block into {len(pending)} files"
+                try:
+                    res = commit_many(repo, branch, pending, commit_message)
+                    cached_tree.clear()
+                    st.write(f"Committed {res['sha'][:7]} to `{branch}`")
+                except Exception as e:
+                    results = [(r[0], "error", str(e)) if r[1] == "ok" else r for r in results]
             progress.progress(100)
             st.success("Wording updates finished")
             st.write("Results:")
@@ -114,7 +168,7 @@ else:
     # Load template JSON from private repo
     config_path = "config/signatures.json"
     try:
-        config_json, _ = get_json_from_repo(repo, config_path)
+        config_json, _ = cached_get_json(repo_fullname, config_path)
     except Exception as e:
         st.error(f"Could not read {config_path} from repo: {e}")
         st.stop()
@@ -125,9 +179,11 @@ else:
     # Build dropdown options from JSON for the chosen location
     preconfigured = config_json.get(loc_key, [])
     # preconfigured is expected to be list of dicts with keys: name, title, min_gift, max_gift (max optional or null)
-    options = ["-- choose preconfigured signee --", *[
-        f'{p["name"]} — {p.get("title","")} — ${p["min_gift"]:,}' for p in preconfigured
-    ]]
+    labels = [f'{p["name"]} — {p.get("title","")} — ${p["min_gift"]:,}' for p in preconfigured]
+    label_to_idx = {}
+    for i, lbl in enumerate(labels):
+        label_to_idx.setdefault(lbl, i)  # first match wins on duplicate labels
+    options = ["-- choose preconfigured signee --", *labels]
     options.append("Other (enter custom)")
     selected = st.selectbox("Choose a preconfigured signee or 'Other':", options)
 
@@ -155,7 +211,7 @@ else:
     else:
         # map selection back to the chosen preconfigured item
         if selected != "-- choose preconfigured signee --":
-            idx = options.index(selected) - 1
+            idx = label_to_idx[selected]
             chosen = preconfigured[idx]
             custom_signees.append({
                 "name": chosen["name"],
@@ -212,50 +268,38 @@ else:
                 <p>Name<br>Title</p>
                 {{/if}}{{/if}}
                 """
-                out_lines = []
-                n = len(tiers_list)
-                if n == 0:
+                if not tiers_list:
                     return ""
-                # For each but the last, add an if; last is else content
-                for i, tier in enumerate(tiers_list):
-                    name = tier["name"]
-                    title = tier.get("title","")
-                    min_g = float(tier["min_gift"])
-                    # We must write a comparison ">" (min_g - 0.01) to represent >= min_g
-                    compare_value = (min_g - 0.01)
-                    compare_value_str = f"{compare_value:0.2f}"
-                    if i < n - 1:
-                        out_lines.append(f'{{{{#if (compare Gift.amount.value ">" {compare_value_str})}}}}')
-                        out_lines.append("<p>")
-                        out_lines.append(name)
-                        out_lines.append("<br>")
-                        out_lines.append(title)
-                        out_lines.append("</p>")
-                        out_lines.append("{{{{else}}}}")
-                    else:
-                        # last tier - provide as else content (no further if)
-                        out_lines.append("<p>")
-                        out_lines.append(name)
-                        out_lines.append("<br>")
-                        out_lines.append(title)
-                        out_lines.append("</p>")
-                        # close previous opened {{#if}} blocks
-                        # After building full else content, we'll append close tags equal to number of opens (n-1)
-                # now append closing tags: one {{/if}} for each nested if
-                for i in range(n - 1):
-                    out_lines.append("{{{{/if}}}}")
-                return "\n".join(out_lines)
+                blocks = []
+                # every tier but the last opens an if; ">" (min_gift - 0.01) represents >= min_gift
+                for t in tiers_list[:-1]:
+                    cv = f"{t['min_gift'] - 0.01:0.2f}"
+                    blocks.append(f'{{{{#if (compare Gift.amount.value ">" {cv})}}}}\n<p>\n{t["name"]}\n<br>\n{t.get("title","")}\n</p>\n{{{{else}}}}')
+                # last tier is the innermost else content, followed by one {{/if}} per opened if
+                t = tiers_list[-1]
+                blocks.append(f'<p>\n{t["name"]}\n<br>\n{t.get("title","")}\n</p>')
+                blocks.extend(["{{/if}}"] * (len(tiers_list) - 1))
+                return "\n".join(blocks)
 
             snippet = build_handlebars(tiers_sorted)
             st.code(snippet, language="")
 
             # Now find live files in updated_letters that end with _live (case-insensitive)
-            live_files = [f for f in list_text_files_in_folder(repo, "updated_letters") if f.name.lower().endswith("_live.txt")]
+            # reuse the sidebar listing of updated_letters from this run
+            live_files = [f for f in updated_files if f["name"].lower().endswith("_live.txt")]
             st.write(f"Found {len(live_files)} _live files in updated_letters to update.")
             results = []
+            pending = {}
+            try:
+                contents = fetch_files_bulk(repo, branch, [f["path"] for f in live_files])
+            except Exception as e:
+                st.error(f"Could not read _live files from repo: {e}")
+                st.stop()
             for f in live_files:
                 try:
-                    original_text, sha = read_file_contents(repo, f.path)
+                    if f["path"] not in contents:
+                        raise ValueError(f"Could not read {f['path']}")
+                    original_text, sha = contents[f["path"]]
                     if loc_key == "denver":
                         start_tag = "<!-- denver sig start -->"
                         end_tag = "<!-- denver sig end -->"
@@ -263,10 +307,20 @@ else:
                         start_tag = "<!-- wslope sig start -->"
                         end_tag = "<!-- wslope sig end -->"
                     new_text = safe_replace_between_tags(original_text, start_tag, end_tag, snippet)
-                    commit_message = f"Signature update ({location}) for {f.name}"
-                    res = write_or_update_file(repo, f.path, new_text, commit_message, branch=branch)
-                    results.append((f.name, "ok", res))
+                    if new_text == original_text:
+                        results.append((f["name"], "skipped", "no change"))
+                        continue
+                    pending[f["path"]] = new_text
+                    results.append((f["name"], "ok", f["path"]))
+                except Exception as e:
+                    results.append((f["name"], "error", str(e)))
+            if pending:
+                commit_message = f"Signature update ({location}) for {len(pending)} files"
+                try:
+                    res = commit_many(repo, branch, pending, commit_message)
+                    cached_tree.clear()
+                    st.write(f"Committed {res['sha'][:7]} to `{branch}`")
                 except Exception as e:
-                    results.append((f.name, "error", str(e)))
+                    results = [(r[0], "error", str(e)) if r[1] == "ok" else r for r in results]
             st.success("Signature updates finished")
             st.dataframe([{"file": r[0], "status": r[1], "detail": r[2]} for r in results])